@@ -1,3 +1,4 @@
+import numpy as np
 import tensorflow as tf
 
 from DeepAgent.agents.doubleDQN import DoubleDQNAgent
@@ -28,7 +29,7 @@ class D3NPERAgent(DoubleDQNAgent):
         assert (isinstance(self.buffer, PrioritizedExperienceReplay)), \
             'The buffer should be a PrioritizedExperienceReplay buffer.'
 
-    @tf.function
+    @tf.function(reduce_retracing=True)
     def get_target(self, rewards, dones, next_states):
         """
         get target q for both single step and n_step
@@ -36,37 +37,33 @@ class D3NPERAgent(DoubleDQNAgent):
         Args:
             rewards (tf.float32): Batch of rewards.
             dones (tf.bool): Batch of terminal status.
-            next_states (tf.float32): Batch of next states.
+            next_states (tf.uint8): Batch of next states.
         """
         action_online = tf.math.argmax(self.policy_network.predict(next_states), axis=1)
-        double_q = tf.reduce_sum(self.target_network.predict(next_states)
-                                 * tf.one_hot(action_online, self.n_actions, 1.0, 0.0), axis=1)
+        double_q = tf.gather(self.target_network.predict(next_states), action_online[:, tf.newaxis],
+                             batch_dims=1)[:, 0]
 
         target_q = rewards + self.gamma * double_q * (1.0 - tf.cast(dones, tf.float32))
 
         return target_q
 
-    @tf.function
     def update_gradient(self, target_q, states, actions, batch_weights=1):
 
         """
-        Update main q network by experience replay method.
+        Update main q network by experience replay method, compiled into a tf.function by BaseAgent.
 
         Args:
             target_q (tf.float32): Target Q value for barch.
 
-            states (tf.float32): Batch of states.
+            states (tf.uint8): Batch of states.
             actions (tf.int32): Batch of actions.
 
             batch_weights(tf.float32): weights of this batch.
         """
 
-        self.policy_network.update_lr()
         with tf.GradientTape() as tape:
             tape.watch(self.policy_network.model.trainable_weights)
-            main_q = tf.reduce_sum(
-                self.policy_network.model(states) * tf.one_hot(actions, self.n_actions, 1.0, 0.0),
-                axis=1)
+            main_q = tf.gather(self.policy_network.model(states), actions[:, tf.newaxis], batch_dims=1)[:, 0]
 
             losses = self.policy_network.loss_function(main_q, target_q)
 
@@ -84,12 +81,61 @@ class D3NPERAgent(DoubleDQNAgent):
 
         return main_q, loss
 
+    def sample_batch(self):
+        """
+        Sample a prioritized batch of transitions from the buffer.
+
+        Returns:
+            Tuple of numpy arrays matching self.get_batch_specs()
+        """
+        with self.buffer.lock:
+            indices = np.asarray(self.buffer.get_sample_indices(), dtype=np.int64)
+            return (indices, self.buffer.generations[indices]) + self.buffer.get_sample_arrays(indices)
+
+    def get_batch_specs(self):
+        """
+        Returns:
+            tf.TensorSpec of indices, generations, states, actions, rewards, dones and next_states
+            returned by self.sample_batch()
+        """
+        batch_size = self.buffer.batch_size
+        states = tf.TensorSpec((batch_size,) + tuple(self.input_shape), tf.uint8)
+        indices = tf.TensorSpec((batch_size,), tf.int64)
+        return (indices, indices, states, tf.TensorSpec((batch_size,), tf.int32),
+                tf.TensorSpec((batch_size,), tf.float32), tf.TensorSpec((batch_size,), tf.bool), states)
+
+    @tf.function(reduce_retracing=True)
+    def update_step(self, batch):
+        """
+        Compute the targets of a batch and update the main q network in one graph call.
+
+        Args:
+            batch: Tuple of tensors matching self.get_batch_specs()
+
+        Returns:
+            indices (tf.int64): Buffer indices of the batch.
+            generations (tf.int64): Write generations of the indices when the batch was sampled.
+            error (tf.float32): Huber error of each transition, used as new priority.
+        """
+        indices, generations, states, actions, rewards, dones, next_states = batch
+
+        target_q = self.get_target(rewards, dones, next_states)
+        main_q, loss = self.update_gradient(target_q, states, actions)
+
+        error = main_q - target_q
+        is_small_error = tf.abs(error) < 1
+        squared_loss = tf.square(error) / 2
+        linear_loss = tf.abs(error) - 0.5
+        error = tf.where(is_small_error, squared_loss, linear_loss)
+
+        return indices, generations, error
+
     def train_step(self):
         """
         Perform 1 step which controls action_selection, interaction with environments
         in self.env_name, batching and gradient updates.
         """
-        action = self.get_action(tf.constant(self.state), tf.constant(self.epsilon, tf.float32))
+        action = self.select_action(self.state, self.epsilon)
 
         next_state, reward, done, info = self.env.step(action)
         self.buffer.append(self.state, action, reward, done, next_state)
@@ -98,16 +144,7 @@ class D3NPERAgent(DoubleDQNAgent):
         self.done = self.env.was_real_done
 
         if self.total_step % self.model_update_freq == 0:
-            indices = self.buffer.get_sample_indices()
-            states, actions, rewards, dones, next_states = self.buffer.get_sample(indices)
-
-            target_q = self.get_target(rewards, dones, next_states)
-            main_q, loss = self.update_gradient(target_q, states, actions)
-
-            error = main_q - target_q
-            is_small_error = tf.abs(error) < 1
-            squared_loss = tf.square(error) / 2
-            linear_loss = tf.abs(error) - 0.5
-            error = tf.where(is_small_error, squared_loss, linear_loss)
-
-            self.buffer.update_priorities(indices, error)
+            # the schedule runs in python, update_step only reads the optimizer's learning rate variable
+            self.policy_network.update_lr()
+            indices, generations, error = self.update_step(next(self.batch_iterator))
+            self.buffer.update_priorities(indices.numpy(), error.numpy(), generations.numpy())
@@ -24,7 +24,7 @@ class DoubleDQNAgent(DQNAgent):
         """
         super(DoubleDQNAgent, self).__init__(env, policy_network, target_network, buffer, agent_id, **kwargs)
 
-    @tf.function
+    @tf.function(reduce_retracing=True)
     def get_target(self, rewards, dones, next_states, n_step_rewards, n_step_dones, n_step_next, ):
         """
         get target q for both single step and n_step
@@ -32,21 +32,21 @@ class DoubleDQNAgent(DQNAgent):
         Args:
             rewards (tf.float32): Batch of rewards.
             dones (tf.bool): Batch of terminal status.
-            next_states (tf.float32): Batch of next states.
+            next_states (tf.uint8): Batch of next states.
 
             n_step_rewards (tf.float32): Batch of after n_step rewards,
             n_step_dones (tf.bool): Batch of terminal status after n_step.
-            n_step_next (tf.float32): Batch of after n_step states.
+            n_step_next (tf.uint8): Batch of after n_step states.
         """
         action_online = tf.math.argmax(self.policy_network.predict(next_states), axis=1)
-        double_q = tf.reduce_sum(self.target_network.predict(next_states)
-                                 * tf.one_hot(action_online, self.n_actions, 1.0, 0.0), axis=1)
+        double_q = tf.gather(self.target_network.predict(next_states), action_online[:, tf.newaxis],
+                             batch_dims=1)[:, 0]
 
         target_q = rewards + self.gamma * double_q * (1.0 - tf.cast(dones, tf.float32))
 
         n_step_action_online = tf.math.argmax(self.target_network.predict(n_step_next), axis=1)
-        n_step_double_q = tf.reduce_sum(self.target_network.predict(n_step_next)
-                                        * tf.one_hot(n_step_action_online, self.n_actions, 1.0, 0.0), axis=1)
+        n_step_double_q = tf.gather(self.target_network.predict(n_step_next), n_step_action_online[:, tf.newaxis],
+                                    batch_dims=1)[:, 0]
 
         n_target_q = n_step_rewards + self.gamma * n_step_double_q * (1.0 - tf.cast(n_step_dones, tf.float32))
 
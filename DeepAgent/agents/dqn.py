@@ -36,7 +36,7 @@ class DQNAgent(BaseAgent, EpsDecayAgent):
 
         EpsDecayAgent.__init__(self, eps_schedule=eps_schedule)
 
-    @tf.function
+    @tf.function(reduce_retracing=True)
     def get_action(self, state, epsilon):
         """Get action by ε-greedy method.
 
@@ -51,7 +51,7 @@ class DQNAgent(BaseAgent, EpsDecayAgent):
         if tf.random.uniform((), minval=0, maxval=1, dtype=tf.float32) < epsilon:
             action = tf.random.uniform((), minval=0, maxval=self.n_actions, dtype=tf.int32)
         else:
-            action = self.policy_network.get_optimal_actions(tf.cast(state, tf.float32))
+            action = self.policy_network.get_optimal_actions(state)
         return action
 
     def at_step_start(self):
@@ -61,7 +61,7 @@ class DQNAgent(BaseAgent, EpsDecayAgent):
         self.total_step += 1
         self.update_epsilon(total_step=self.total_step)
 
-    @tf.function
+    @tf.function(reduce_retracing=True)
     def get_target(self, rewards, dones, next_states, n_step_rewards, n_step_dones, n_step_next, ):
 
         """
@@ -70,11 +70,11 @@ class DQNAgent(BaseAgent, EpsDecayAgent):
         Args:
             rewards (tf.float32): Batch of rewards.
             dones (tf.bool): Batch of terminal status.
-            next_states (tf.float32): Batch of next states.
+            next_states (tf.uint8): Batch of next states.
 
             n_step_rewards (tf.float32): Batch of after n_step rewards,
             n_step_dones (tf.bool): Batch of terminal status after n_step.
-            n_step_next (tf.float32): Batch of after n_step states.
+            n_step_next (tf.uint8): Batch of after n_step states.
         """
 
         next_state_q = self.target_network.predict(next_states)
@@ -86,28 +86,24 @@ class DQNAgent(BaseAgent, EpsDecayAgent):
         n_target_q = n_step_rewards + self.gamma * n_step_max_q * (1.0 - tf.cast(n_step_dones, tf.float32))
         return target_q, n_target_q
 
-    @tf.function
     def update_gradient(self, target_q, n_step_target_q, states, actions, batch_weights=1):
 
         """
-        Update main q network by experience replay method.
+        Update main q network by experience replay method, compiled into a tf.function by BaseAgent.
 
         Args:
             target_q (tf.float32): Target Q value for barch.
             n_step_target_q (tf.int32): Target Q value after n_step.
 
-            states (tf.float32): Batch of states.
+            states (tf.uint8): Batch of states.
             actions (tf.int32): Batch of actions.
 
             batch_weights(tf.float32): weights of this batch.
         """
 
-        self.policy_network.update_lr()
         with tf.GradientTape() as tape:
             tape.watch(self.policy_network.model.trainable_weights)
-            main_q = tf.reduce_sum(
-                self.policy_network.model(states) * tf.one_hot(actions, self.n_actions, 1.0, 0.0),
-                axis=1)
+            main_q = tf.gather(self.policy_network.model(states), actions[:, tf.newaxis], batch_dims=1)[:, 0]
 
             losses = self.policy_network.loss_function(main_q, target_q) * self.policy_network.one_step_weight
             losses += self.policy_network.loss_function(main_q, n_step_target_q) * self.policy_network.n_step_weight
@@ -126,12 +122,51 @@ class DQNAgent(BaseAgent, EpsDecayAgent):
 
         return main_q, loss
 
+    def sample_batch(self):
+        """
+        Sample a batch of one step and n_step transitions from the buffer.
+
+        Returns:
+            Tuple of numpy arrays matching self.get_batch_specs()
+        """
+        with self.buffer.lock:
+            indices = self.buffer.get_sample_indices()
+            return (self.buffer.get_sample_arrays(indices)
+                    + self.buffer.get_n_step_sample_arrays(indices, gamma=self.gamma))
+
+    def get_batch_specs(self):
+        """
+        Returns:
+            tf.TensorSpec of states, actions, rewards, dones, next_states,
+            n_step_rewards, n_step_dones and n_step_next returned by self.sample_batch()
+        """
+        batch_size = self.buffer.batch_size
+        states = tf.TensorSpec((batch_size,) + tuple(self.input_shape), tf.uint8)
+        return (states, tf.TensorSpec((batch_size,), tf.int32), tf.TensorSpec((batch_size,), tf.float32),
+                tf.TensorSpec((batch_size,), tf.bool), states, tf.TensorSpec((batch_size,), tf.float32),
+                tf.TensorSpec((batch_size,), tf.bool), states)
+
+    @tf.function(reduce_retracing=True)
+    def update_step(self, batch):
+        """
+        Compute the targets of a batch and update the main q network in one graph call.
+
+        Args:
+            batch: Tuple of tensors matching self.get_batch_specs()
+        """
+        states, actions, rewards, dones, next_states, n_step_rewards, n_step_dones, n_step_next = batch
+
+        target_q, n_step_target_q = self.get_target(rewards, dones, next_states,
+                                                    n_step_rewards, n_step_dones, n_step_next)
+
+        self.update_gradient(target_q, n_step_target_q, states, actions)
+
     def train_step(self):
         """
         Perform 1 step which controls action_selection, interaction with environments
         in self.env_name, batching and gradient updates.
         """
-        action = self.get_action(tf.constant(self.state), tf.constant(self.epsilon, tf.float32))
+        action = self.select_action(self.state, self.epsilon)
 
         next_state, reward, done, info = self.env.step(action)
         self.buffer.append(self.state, action, reward, done, next_state)
@@ -140,14 +175,9 @@ class DQNAgent(BaseAgent, EpsDecayAgent):
         self.done = self.env.was_real_done
 
         if self.total_step % self.model_update_freq == 0:
-            indices = self.buffer.get_sample_indices()
-
-            states, actions, rewards, dones, next_states = self.buffer.get_sample(indices)
-            n_step_rewards, n_step_dones, n_step_next = self.buffer.get_n_step_sample(indices, gamma=self.gamma)
-            target_q, n_step_target_q = self.get_target(rewards, dones, next_states,
-                                                        n_step_rewards, n_step_dones, n_step_next)
-
-            self.update_gradient(target_q, n_step_target_q, states, actions)
+            # the schedule runs in python, update_step only reads the optimizer's learning rate variable
+            self.policy_network.update_lr()
+            self.update_step(next(self.batch_iterator))
 
     def at_step_end(self):
         if self.total_step % self.target_sync_freq == 0:
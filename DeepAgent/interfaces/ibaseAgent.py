@@ -35,8 +35,16 @@ class BaseAgent(ABC):
             log_history=False,
             validation_freq=10,
             quiet=False,
+            vector_env=None,
+            fill_segment_length=128,
+            prefetch_batches=4,
+            jit_compile=False,
     ):
         self.env = env
+        self.vector_env = vector_env
+        self.fill_segment_length = fill_segment_length
+        self.prefetch_batches = prefetch_batches
+        self.batch_iterator = None
         self.game_id = env.id
         self.agent_id = agent_id
         self.n_actions = self.env.action_space.n
@@ -52,6 +60,10 @@ class BaseAgent(ABC):
         self.n_step = buffer.n_step if buffer.n_step else 0
         self.epsilon = None
 
+        # inputs of self.get_action(), assigned in place every step so that it is traced only once
+        self.state_variable = tf.Variable(tf.zeros(self.input_shape, tf.uint8), trainable=False)
+        self.epsilon_variable = tf.Variable(1.0, trainable=False)
+
         self.state = self.env.reset()
         self.done = False
 
@@ -77,6 +89,9 @@ class BaseAgent(ABC):
         self.policy_network = policy_network
         self.target_network = target_network
 
+        # XLA is opt-in, it is not supported on every platform (e.g. tensorflow-metal)
+        self.update_gradient = tf.function(self.update_gradient, jit_compile=jit_compile, reduce_retracing=True)
+
         self.loss_metric = tf.keras.metrics.Mean('loss_metric', dtype=tf.float32)
         self.q_metric = tf.keras.metrics.Mean(name="Q_value")
 
@@ -129,6 +144,9 @@ class BaseAgent(ABC):
         """
         Fill replay buffer up to its initial size.
         """
+        if self.vector_env is not None:
+            self.fill_buffer_vectorized(load=load)
+            return
         episode = 0
         total_size = self.buffer.size
         state = self.env.reset()
@@ -136,7 +154,7 @@ class BaseAgent(ABC):
             if not load:
                 action = self.env.action_space.sample()
             else:
-                action = np.argmax(self.policy_network.predict(tf.expand_dims(state, axis=0)))
+                action = np.argmax(self.policy_network.predict(tf.expand_dims(np.asarray(state), axis=0)))
             new_state, reward, done, _ = self.env.step(action)
             self.buffer.append(state, action, reward, done, new_state)
             state = new_state
@@ -154,6 +172,69 @@ class BaseAgent(ABC):
         self.display_message('')
         self.reset_env()
 
+    def sample_generator(self):
+        """
+        Endlessly yield batches of self.sample_batch() for the prefetching dataset.
+        """
+        while True:
+            yield self.sample_batch()
+
+    def build_batch_iterator(self):
+        """
+        Sample batches from the buffer in a tf.data background thread, up to self.prefetch_batches batches
+        are kept ready so that sampling overlaps with the environment steps and gradient updates.
+        sample_batch() holds self.buffer.lock, so batches never see a half written transition, but a batch
+        is used up to self.prefetch_batches updates after it was sampled and misses the transitions and
+        priorities written in between.
+        Returns:
+            Iterator over tuples of tensors matching self.get_batch_specs()
+        """
+        dataset = tf.data.Dataset.from_generator(self.sample_generator, output_signature=self.get_batch_specs())
+        return iter(dataset.prefetch(self.prefetch_batches))
+
+    def fill_buffer_vectorized(self, load=False):
+        """
+        Fill replay buffer up to its initial size by stepping all environments of self.vector_env at once,
+        actions of all environments are chosen by a single batched forward pass when load is True.
+        Transitions of each environment are collected for self.fill_segment_length steps and appended
+        environment by environment, which keeps consecutive transitions in the buffer sharing their frames.
+        A segment boundary is not an episode end, its n_step targets are truncated and bootstrap from the last
+        transition of the segment.
+        Environments reset automatically, the new_state of a done transition is then the reset state,
+        which is masked out of the targets by done.
+        """
+        total_size = self.buffer.size
+        n_envs = self.vector_env.num_envs
+        states = np.asarray(self.vector_env.reset())
+        while self.buffer.current_size < self.buffer_fill_size:
+            segments = [[] for _ in range(n_envs)]
+            for _ in range(self.fill_segment_length):
+                if not load:
+                    actions = self.vector_env.action_space.sample()
+                else:
+                    actions = np.argmax(self.policy_network.predict(states), axis=1)
+                new_states, rewards, dones, _ = self.vector_env.step(actions)
+                new_states = np.asarray(new_states)
+                for i, segment in enumerate(segments):
+                    segment.append((states[i], actions[i], rewards[i], dones[i], new_states[i]))
+                states = new_states
+
+            for segment in segments:
+                for transition in segment:
+                    self.buffer.append(*transition)
+            filled = self.buffer.current_size
+            self.display_message(
+                f'\rFilling experience replay buffer with {n_envs} environments => '
+                f'{filled}/{total_size}',
+                end='',
+            )
+
+        self.display_message('')
+        # the worker processes are only needed to fill the buffer, training steps self.env
+        self.vector_env.close()
+        self.vector_env = None
+        self.reset_env()
+
     def reset_env(self):
         """
         Reset env with no return
@@ -180,7 +261,16 @@ class BaseAgent(ABC):
     def sync_target_model(self):
         """Synchronize weights of target network by those of main network."""
         self.display_message("Synchronizing target model...")
-        self.target_network.model.set_weights(self.policy_network.model.get_weights())
+        self.copy_weights()
+
+    @tf.function(reduce_retracing=True)
+    def copy_weights(self):
+        """
+        Copy every variable of the main network into the target network inside one graph,
+        without the device to host round trip of get_weights() and set_weights().
+        """
+        tf.nest.map_structure(lambda target, main: target.assign(main),
+                              self.target_network.model.variables, self.policy_network.model.variables)
 
     def display_learning_state(self):
         """
@@ -326,7 +416,7 @@ class BaseAgent(ABC):
             self.reset_env()
             step = 0
             while not self.done and step < max_step:
-                action = self.get_action(tf.constant(self.state), tf.constant(epsilon, tf.float32))
+                action = self.select_action(self.state, epsilon)
                 next_state, _, _, _ = self.env.step(action)
                 self.state = next_state
                 self.done = self.env.was_real_done
@@ -388,6 +478,35 @@ class BaseAgent(ABC):
             else:
                 self.total_step = 0
         self.fill_buffer(load=load)
+        self.batch_iterator = self.build_batch_iterator()
+
+    def select_action(self, state, epsilon):
+        """
+        Choose an action for a single state by self.get_action().
+        Args:
+            state: The stacked frames of the current state.
+            epsilon: Exploration rate.
+        Returns:
+            action (tf.int32): Action index
+        """
+        self.state_variable.assign(np.asarray(state))
+        self.epsilon_variable.assign(epsilon)
+        return self.get_action(self.state_variable, self.epsilon_variable)
+
+    def sample_batch(self):
+        raise NotImplementedError(
+            f'sample_batch() should be implemented by {self.__class__.__name__} subclasses'
+        )
+
+    def get_batch_specs(self):
+        raise NotImplementedError(
+            f'get_batch_specs() should be implemented by {self.__class__.__name__} subclasses'
+        )
+
+    def update_gradient(self, *args, **kwargs):
+        raise NotImplementedError(
+            f'update_gradient() should be implemented by {self.__class__.__name__} subclasses'
+        )
 
     def get_action(self, state, epsilon):
         raise NotImplementedError(
@@ -475,7 +594,7 @@ class BaseAgent(ABC):
                 env.render()
                 sleep(frame_delay)
 
-            action = self.get_action(tf.constant(state), tf.constant(epsilon, tf.float32))
+            action = self.select_action(state, epsilon)
             state, reward, done, _ = env.step(action)
             episode_reward += reward
 
@@ -9,6 +9,8 @@ class BaseConfig(ABC):
     """
 
     USE_GPU = False
+    MIXED_PRECISION = False
+    JIT_COMPILE = False
 
     '''Training parameters'''
     MAX_STEP = 1e7
@@ -66,6 +68,13 @@ class BaseConfig(ABC):
     BATCH_SIZE = 32
     BUFFER_FILL_SIZE = 50000
 
+    '''
+    Parallel environments used only to fill the buffer before training, 1 disables them
+    the i-th environment is seeded with BUFFER_FILL_SEED + i, a random base seed is drawn if None
+    '''
+    BUFFER_FILL_ENVS = 1
+    BUFFER_FILL_SEED = None
+
     '''
     Evaluation Parameters
     '''
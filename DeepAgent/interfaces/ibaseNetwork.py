@@ -20,6 +20,7 @@ class BaseNetwork(ABC):
                  n_step_weight=1.0,
                  l2_weight=0.0,
                  quiet=False,
+                 data_format='channels_last',
                  ):
 
         conv_layers = {
@@ -49,8 +50,13 @@ class BaseNetwork(ABC):
 
         self.conv_layers = conv_layers
         self.dense_layers = dense_layers
+        # cuDNN convolutions run natively in NCHW, while the CPU kernels only support NHWC
+        self.data_format = data_format
+        self.channel_axis = 1 if self.data_format == 'channels_first' else 3
 
         self.optimizer = optimizer(learning_rate=lr_schedule[0][0])
+        if tf.keras.mixed_precision.global_policy().compute_dtype == 'float16':
+            self.optimizer = tf.keras.mixed_precision.LossScaleOptimizer(self.optimizer)
         self.loss_function = loss_function
         self.one_step_weight = one_step_weight
         self.n_step_weight = n_step_weight
@@ -72,19 +78,33 @@ class BaseNetwork(ABC):
         if not self.quiet:
             self.model.summary()
 
+    def scale_input(self, model_input):
+        """
+        Scale the (H, W, frame_stack) uint8 input to [0, 1] and then, for channels_first, transpose
+        it once to (frame_stack, H, W) so the convolutions need no layout conversion.
+        Args:
+            model_input: The uint8 keras Input of the model
+        Returns:
+            The input of the first convolution
+        """
+        scale = tf.keras.layers.Rescaling(1.0 / 255.0)(model_input)
+        if self.data_format == 'channels_first':
+            scale = tf.keras.layers.Permute((3, 1, 2))(scale)
+        return scale
+
     def load(self, path):
         self.model.load_weights(path)
 
     def save(self, path):
         self.model.save_weights(path)
 
-    @tf.function
+    @tf.function(reduce_retracing=True)
     def predict(self, states):
         """Perform a forward pass through the network, (Predict Q values)"""
         predictions = self.model(states, training=False)
         return predictions
 
-    @tf.function
+    @tf.function(reduce_retracing=True)
     def get_optimal_actions(self, states):
         """Get the optimal actions for some states corresponding
            to the current policy defined by the network parameters"""
@@ -102,7 +122,7 @@ class BaseNetwork(ABC):
 
     def update_lr(self):
         self.update_counter += 1
-        self.optimizer._set_hyper('learning_rate', self._get_current_lr())
+        self.optimizer.learning_rate = self._get_current_lr()
 
     def get_last_conv2d_name(self):
         last_conv_layer_name = list(filter(lambda x: isinstance(x, tf.keras.layers.Conv2D), self.model.layers))[-1].name
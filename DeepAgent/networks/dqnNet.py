@@ -12,8 +12,9 @@ class DQNNetwork(BaseNetwork):
 
     def build(self):
 
-        model_input = tf.keras.layers.Input(shape=(self.input_shape[0], self.input_shape[1], self.frame_stack))
-        scale = tf.keras.layers.Lambda(lambda p: p / 255.0)(model_input)
+        model_input = tf.keras.layers.Input(shape=(self.input_shape[0], self.input_shape[1], self.frame_stack),
+                                            dtype=tf.uint8)
+        scale = self.scale_input(model_input)
 
         conv_layers = []
 
@@ -30,10 +31,11 @@ class DQNNetwork(BaseNetwork):
                                                       activation=self.conv_layers['activations'][layer_id],
                                                       kernel_initializer=self.conv_layers['initializers'][layer_id],
                                                       name=self.conv_layers['names'][layer_id],
+                                                      data_format=self.data_format,
                                                       use_bias=False
                                                       )(conv_input))
 
-        flatten = tf.keras.layers.Flatten()(conv_layers[-1])
+        flatten = tf.keras.layers.Flatten(data_format=self.data_format)(conv_layers[-1])
         dense_layers = []
 
         for layer_id in tf.range(len(self.dense_layers['units'])):
@@ -50,7 +52,8 @@ class DQNNetwork(BaseNetwork):
 
         out_layer = tf.keras.layers.Dense(units=self.n_actions,
                                           kernel_initializer=tf.initializers.VarianceScaling(scale=2.0),
-                                          name='out_layer'
+                                          name='out_layer',
+                                          dtype='float32'
                                           )(dense_layers[-1])
 
         model = tf.keras.models.Model(inputs=[model_input], outputs=[out_layer])
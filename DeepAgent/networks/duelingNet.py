@@ -15,8 +15,9 @@ class DuelingNetwork(BaseNetwork):
 
     def build(self):
 
-        model_input = tf.keras.layers.Input(shape=(self.input_shape[0], self.input_shape[1], self.frame_stack))
-        scale = tf.keras.layers.Lambda(lambda p: p / 255.0)(model_input)
+        model_input = tf.keras.layers.Input(shape=(self.input_shape[0], self.input_shape[1], self.frame_stack),
+                                            dtype=tf.uint8)
+        scale = self.scale_input(model_input)
 
         conv_layers = []
 
@@ -33,19 +34,20 @@ class DuelingNetwork(BaseNetwork):
                                                       activation=self.conv_layers['activations'][layer_id],
                                                       kernel_initializer=self.conv_layers['initializers'][layer_id],
                                                       name=self.conv_layers['names'][layer_id],
+                                                      data_format=self.data_format,
                                                       use_bias=False
                                                       )(conv_input))
 
         if self.dense_layers is None:
-            value_stream, advantage_stream = tf.split(conv_layers[-1], 2, 3)
-            value_stream = tf.keras.layers.Flatten()(value_stream)
-            advantage_stream = tf.keras.layers.Flatten()(advantage_stream)
+            value_stream, advantage_stream = tf.split(conv_layers[-1], 2, self.channel_axis)
+            value_stream = tf.keras.layers.Flatten(data_format=self.data_format)(value_stream)
+            advantage_stream = tf.keras.layers.Flatten(data_format=self.data_format)(advantage_stream)
         else:
             dense_layers = []
 
             for layer_id in tf.range(len(self.dense_layers['units'])):
                 if layer_id == 0:
-                    dense_input = tf.keras.layers.Flatten()(conv_layers[-1])
+                    dense_input = tf.keras.layers.Flatten(data_format=self.data_format)(conv_layers[-1])
                 else:
                     dense_input = dense_layers[-1]
 
@@ -60,12 +62,14 @@ class DuelingNetwork(BaseNetwork):
 
         value_layer = tf.keras.layers.Dense(units=1,
                                             kernel_initializer=tf.initializers.VarianceScaling(scale=2.0),
-                                            name='value_layer'
+                                            name='value_layer',
+                                            dtype='float32'
                                             )(value_stream)
 
         advantage_layer = tf.keras.layers.Dense(units=self.n_actions,
                                                 kernel_initializer=tf.initializers.VarianceScaling(scale=2.0),
-                                                name='advantage_layer'
+                                                name='advantage_layer',
+                                                dtype='float32'
                                                 )(advantage_stream)
 
         out_layer = value_layer + tf.math.subtract(advantage_layer,
@@ -6,13 +6,15 @@ from DeepAgent.interfaces.ibaseNetwork import BaseNetwork
 class DuelingResNet(BaseNetwork):
 
     def __init__(self, **kwargs):
-
+        # keras.applications.ResNet50V2 is built in the global (NHWC) image data format
+        kwargs['data_format'] = 'channels_last'
         super(DuelingResNet, self).__init__(**kwargs)
         self.build()
 
     def build(self):
-        model_input = tf.keras.layers.Input(shape=(self.input_shape[0], self.input_shape[1], self.frame_stack))
-        scale = tf.keras.layers.Lambda(lambda p: p / 255.0)(model_input)
+        model_input = tf.keras.layers.Input(shape=(self.input_shape[0], self.input_shape[1], self.frame_stack),
+                                            dtype=tf.uint8)
+        scale = tf.keras.layers.Rescaling(1.0 / 255.0)(model_input)
         pre_input = tf.keras.applications.mobilenet.preprocess_input(scale)
 
         x = tf.keras.applications.ResNet50V2(include_top=False, weights=None, input_tensor=pre_input)(pre_input)
@@ -33,12 +35,14 @@ class DuelingResNet(BaseNetwork):
 
         value_layer = tf.keras.layers.Dense(units=1,
                                             kernel_initializer=tf.initializers.VarianceScaling(scale=2.0),
-                                            name='value_layer'
+                                            name='value_layer',
+                                            dtype='float32'
                                             )(dense_layers[-1])
 
         advantage_layer = tf.keras.layers.Dense(units=self.n_actions,
                                                 kernel_initializer=tf.initializers.VarianceScaling(scale=2.0),
-                                                name='advantage_layer'
+                                                name='advantage_layer',
+                                                dtype='float32'
                                                 )(dense_layers[-1])
 
         out_layer = value_layer + tf.math.subtract(advantage_layer,
@@ -1,4 +1,4 @@
 from .buffer import ExperienceReplay, PrioritizedExperienceReplay
-from .game import GameEnv
+from .game import GameEnv, make_vector_env
 from .offPolicyWrapper import TrainWrapper, TestWrapper, VisualizationWrapper
 
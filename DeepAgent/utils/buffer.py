@@ -1,79 +1,210 @@
+import threading
+
 import tensorflow as tf
 import numpy as np
 
-from collections import deque
 from DeepAgent.interfaces.ibaseBuffer import BaseBuffer, Transition
 
 
 class ExperienceReplay(BaseBuffer):
     """
-    This class manages buffer of agent.
+    This class manages buffer of agent, transitions are stored field by field in preallocated numpy arrays
+    which are written in circular (FIFO) order. Consecutive stacked states share all but one frame, so only
+    the newest frame of every new_state is stored and the stacks are rebuilt from consecutive slots.
     """
 
     def __init__(self, size, **kwargs):
         super(ExperienceReplay, self).__init__(size, **kwargs)
-        self._buffer = deque(maxlen=size)
+        self.size = int(size)
+        self.index = 0
+        self.frame_stack = None
+        self.frames = None
+        self.actions = np.empty(self.size, dtype=np.int32)
+        self.rewards = np.empty(self.size, dtype=np.float32)
+        self.dones = np.empty(self.size, dtype=np.bool_)
+        self.valid = np.zeros(self.size, dtype=np.bool_)
+        # number of writes to each slot, lets a late priority update detect that its slot was rewritten
+        self.generations = np.zeros(self.size, dtype=np.int64)
+        self.rng = np.random.default_rng()
+        # held by append(), update_priorities() and the agent's sample_batch(), which runs on a tf.data thread
+        self.lock = threading.Lock()
 
-    def append(self, *args):
-        transition = Transition(*args)
-        self._buffer.append(transition)
-        self.current_size = len(self._buffer)
+    def _allocate(self, state):
+        """
+        Allocate the frame array from the shape of the first appended (H, W, frame_stack) state.
+        """
+        self.frame_stack = np.shape(state)[-1]
+        self.frames = np.empty((self.size,) + np.shape(state)[:-1], dtype=np.uint8)
 
-    def get_sample_indices(self):
-        assert self.current_size > self.n_step
-        indices = []
-        while len(indices) < self.batch_size:
-            index = np.random.randint(low=0, high=self.current_size - self.n_step, dtype=np.int32)
-            indices.append(index)
-        return indices
+    def _stack(self, indices):
+        """
+        Rebuild the (..., H, W, frame_stack) states whose newest frames are stored at indices.
+        """
+        window = (np.asarray(indices)[..., np.newaxis] + np.arange(1 - self.frame_stack, 1)) % self.size
+        return np.moveaxis(self.frames[window], -3, -1)
 
-    def get_sample(self, indices):
-        states, actions, rewards, dones, new_states = [], [], [], [], []
+    def _continues(self, state):
+        """
+        Check whether state is the new_state of the last appended transition.
+        """
+        if self.current_size == 0:
+            return False
+        return np.array_equal(state, self._stack((self.index - 1) % self.size))
 
-        for index in indices:
-            item = self._buffer[index]
-            states.append(tf.constant(item.state, tf.float32))
-            actions.append(tf.constant(item.action, tf.int32))
-            rewards.append(tf.constant(item.reward, tf.float32))
-            dones.append(tf.constant(item.done, tf.bool))
-            new_states.append(tf.constant(item.new_state, tf.float32))
+    def _write(self, frame, action, reward, done, valid):
+        """
+        Write one slot at the circular index, the slot whose stack would now reach into the
+        overwritten frame can no longer be sampled.
+        """
+        self.frames[self.index] = frame
+        self.actions[self.index] = action
+        self.rewards[self.index] = reward
+        self.dones[self.index] = done
+        self.valid[self.index] = valid
+        self.generations[self.index] += 1
+        self.valid[(self.index + self.frame_stack) % self.size] = False
+        self.index = (self.index + 1) % self.size
+        self.current_size = min(self.current_size + 1, self.size)
 
-        return (tf.stack(states, axis=0), tf.stack(actions, axis=0), tf.stack(rewards, axis=0),
-                tf.stack(dones, axis=0), tf.stack(new_states, axis=0))
+    def append(self, state, action, reward, done, new_state):
+        """
+        Add a transition, only the newest frame of new_state is stored. If state does not continue the
+        previous transition (e.g. after a reset), its frames are first written into padding slots which
+        are never sampled, so stacks never cross an episode boundary. Padding slots are not done, an n_step
+        lookahead reaching one stops there and bootstraps from the last transition before it.
+        """
+        state, new_state = np.asarray(state), np.asarray(new_state)
+        with self.lock:
+            if self.frames is None:
+                self._allocate(state)
+            if not self._continues(state):
+                for i in range(self.frame_stack):
+                    self._write(state[..., i], 0, 0.0, False, False)
+            self._write(new_state[..., -1], action, reward, done, True)
 
-    def get_n_step_sample(self, indices, gamma=0.99):
-        n_step_rewards, n_step_dones, n_step_next_states = [], [], []
+    def _draw_indices(self, n):
+        offsets = self.rng.integers(0, self.current_size - self.n_step, size=n, dtype=np.int64)
+        return (self.index - self.current_size + offsets) % self.size
+
+    def get_sample_indices(self):
+        assert self.current_size > self.n_step + self.frame_stack
+        indices = self._draw_indices(self.batch_size)
+        invalid = ~self.valid[indices]
+        while invalid.any():
+            indices[invalid] = self._draw_indices(np.count_nonzero(invalid))
+            invalid = ~self.valid[indices]
+        return indices
+
+    def get_sample_arrays(self, indices):
+        """
+        Gather a batch of transitions as numpy arrays, frames are kept in uint8.
+        """
+        indices = np.asarray(indices)
+        window = (indices[:, np.newaxis] + np.arange(-self.frame_stack, 1)) % self.size
+        frames = np.moveaxis(self.frames[window], 1, -1)
+        return frames[..., :-1], self.actions[indices], self.rewards[indices], self.dones[indices], frames[..., 1:]
 
-        for index in indices:
-            item = self._buffer[index]
-            total_reward = item.reward
-            next_state = item.new_state
-            next_done = item.done
+    def get_sample(self, indices):
+        states, actions, rewards, dones, new_states = self.get_sample_arrays(indices)
+        return (tf.convert_to_tensor(states),
+                tf.convert_to_tensor(actions),
+                tf.convert_to_tensor(rewards),
+                tf.convert_to_tensor(dones),
+                tf.convert_to_tensor(new_states))
 
-            for i in range(self.n_step):
-                next_item = self._buffer[index + i]
-                if next_done is True:
-                    break
-                total_reward += (gamma ** i) * next_item.reward
-                next_done = next_item.done
-                next_state = next_item.new_state
+    def get_n_step_sample_arrays(self, indices, gamma=0.99):
+        """
+        Gather the discounted n_step rewards, terminal status and states after n_step as numpy arrays.
+        The lookahead stops at a done transition or before the first slot that is not a valid transition.
+        """
+        indices = np.asarray(indices)
+        n_step_rewards = self.rewards[indices].copy()
+        n_step_dones = self.dones[indices].copy()
+        n_step_next_indices = indices.copy()
 
-            n_step_rewards.append(tf.constant(total_reward, tf.float32))
-            n_step_dones.append(tf.constant(next_done, tf.bool))
-            n_step_next_states.append(tf.constant(next_state, tf.float32))
+        alive = np.ones(indices.shape, dtype=np.bool_)
+        for i in range(self.n_step):
+            next_indices = (indices + i) % self.size
+            alive &= ~n_step_dones & self.valid[next_indices]
+            n_step_rewards += np.where(alive, np.float32(gamma ** i) * self.rewards[next_indices], np.float32(0.0))
+            n_step_dones = np.where(alive, self.dones[next_indices], n_step_dones)
+            n_step_next_indices = np.where(alive, next_indices, n_step_next_indices)
 
-        return tf.stack(n_step_rewards, axis=0), tf.stack(n_step_dones, axis=0), tf.stack(n_step_next_states, axis=0)
+        return n_step_rewards, n_step_dones, self._stack(n_step_next_indices)
+
+    def get_n_step_sample(self, indices, gamma=0.99):
+        n_step_rewards, n_step_dones, n_step_next_states = self.get_n_step_sample_arrays(indices, gamma=gamma)
+        return (tf.convert_to_tensor(n_step_rewards), tf.convert_to_tensor(n_step_dones),
+                tf.convert_to_tensor(n_step_next_states))
 
     def __len__(self):
-        return len(self._buffer)
+        return self.current_size
 
     def __getitem__(self, i):
-        return self._buffer[i]
+        return Transition(self._stack(i - 1), self.actions[i], self.rewards[i], self.dones[i], self._stack(i))
 
     def __repr__(self):
         return self.__class__.__name__ + "({})".format(self.size)
 
 
+class SumTree:
+    """
+    Binary tree where every parent node holds the sum of its children and the leaves hold
+    the priorities, used for O(log N) proportional sampling in prioritized experience replay.
+    """
+
+    def __init__(self, size):
+        """
+        Initialize sum tree.
+        Args:
+            size: Number of leaves (priorities) the tree holds.
+        """
+        self.size = int(size)
+        self.tree = np.zeros(2 * self.size - 1, dtype=np.float32)
+
+    def total(self):
+        """
+        Returns:
+            Sum of all priorities stored in the tree.
+        """
+        return self.tree[0]
+
+    def __setitem__(self, indices, values):
+        """
+        Set the priorities of one or several leaves and refresh all of their ancestors.
+        Parents are recomputed from their children level by level, so shared ancestors are
+        only updated once per level and no float32 error accumulates in the inner nodes.
+        """
+        idx = np.atleast_1d(np.asarray(indices, dtype=np.int64)) + self.size - 1
+        self.tree[idx] = values
+        while idx.size:
+            idx = np.unique((idx[idx > 0] - 1) // 2)
+            self.tree[idx] = self.tree[2 * idx + 1] + self.tree[2 * idx + 2]
+
+    def __getitem__(self, index):
+        return self.tree[index + self.size - 1]
+
+    def find_prefixsum_idx(self, prefixsum):
+        """
+        Find the leaves whose cumulative priority ranges contain prefixsum, all cursors
+        walk down the tree in parallel.
+        Args:
+            prefixsum: An array of values in [0, self.total())
+        Returns:
+            The indices of the leaves
+        """
+        prefixsum = np.array(prefixsum, dtype=np.float32, ndmin=1)
+        idx = np.zeros(prefixsum.shape, dtype=np.int64)
+        internal = idx < self.size - 1
+        while internal.any():
+            left = np.where(internal, 2 * idx + 1, idx)
+            go_right = internal & (prefixsum > self.tree[left])
+            prefixsum = np.where(go_right, prefixsum - self.tree[left], prefixsum)
+            idx = np.where(go_right, left + 1, left)
+            internal = idx < self.size - 1
+        return idx - (self.size - 1)
+
+
 class PrioritizedExperienceReplay(ExperienceReplay):
     """
     This Prioritized Experience Replay Memory class
@@ -89,53 +220,48 @@ class PrioritizedExperienceReplay(ExperienceReplay):
             epsilon: The small priority for new transition appending into buffer
         """
         super(PrioritizedExperienceReplay, self).__init__(size, **kwargs)
-        self.size = int(size)
-        self._buffer = []
-        self.priorities = np.array([])
+        self.tree = SumTree(self.size)
+        self.max_priority = epsilon
         self.prob_alpha = prob_alpha
         self.epsilon = epsilon
 
-    def append(self, *args):
+    def _write(self, frame, action, reward, done, valid):
         """
-        Append experience and auto-allocate to temp buffer / main buffer(self)
-        Args:
-            *args: Items to store
-        """
-        transition = Transition(*args)
-        if self.current_size < self.size:
-            self._buffer.append(transition)
-            self.priorities = np.append(
-                self.priorities,
-                self.epsilon if self.priorities.size == 0 else np.amax(self.priorities))
-        else:
-            idx = np.argmin(self.priorities)
-            self._buffer[idx] = transition
-            self.priorities[idx] = np.amax(self.priorities)
-        self.current_size = len(self._buffer)
+        Write one slot and its priority, new transitions are assigned the maximum priority seen so far
+        while padding slots and the slot invalidated by this write get a zero priority.
+        """
+        index = self.index
+        super(PrioritizedExperienceReplay, self)._write(frame, action, reward, done, valid)
+        priority = self.max_priority ** self.prob_alpha if valid else 0.0
+        self.tree[[(index + self.frame_stack) % self.size, index]] = [0.0, priority]
 
     def get_sample_indices(self):
-        probs = np.copy(self.priorities[:-self.n_step])
-        probs /= probs.sum()
-        indices = np.random.choice(self.current_size - self.n_step,
-                                   self.batch_size,
-                                   p=probs,
-                                   replace=False)
+        indices = self.tree.find_prefixsum_idx(self.rng.uniform(0, self.tree.total(), size=self.batch_size))
+        empty = self.tree[indices] == 0
+        while empty.any():
+            n_empty = np.count_nonzero(empty)
+            indices[empty] = self.tree.find_prefixsum_idx(self.rng.uniform(0, self.tree.total(), size=n_empty))
+            empty = self.tree[indices] == 0
         return indices
 
-    def update_priorities(self, indices, errors):
+    def update_priorities(self, indices, errors, generations=None):
         """
-        Update priorities for chosen samples
+        Update priorities for chosen samples, the batch may have been sampled a few updates earlier,
+        so slots which became padding or were invalidated since then keep their zero priority, and
+        slots rewritten since then keep the priority of their new transition.
         Args:
             errors: abs of Y and Y_Predict
             indices: The index of the element
+            generations: self.generations[indices] at sampling time, if None rewrites are not detected
         """
-        self.priorities[indices] = errors ** self.prob_alpha + self.epsilon
-
-    def __len__(self):
-        return len(self._buffer)
-
-    def __getitem__(self, i):
-        return self._buffer[i]
-
-    def __repr__(self):
-        return self.__class__.__name__ + "({})".format(self.size)
+        indices = np.asarray(indices)
+        priorities = np.abs(np.asarray(errors, dtype=np.float32)) + self.epsilon
+        with self.lock:
+            valid = self.valid[indices]
+            if generations is not None:
+                valid &= self.generations[indices] == np.asarray(generations)
+            if not valid.any():
+                return
+            indices, priorities = indices[valid], priorities[valid]
+            self.tree[indices] = priorities ** self.prob_alpha
+            self.max_priority = max(self.max_priority, float(priorities.max()))
@@ -2,8 +2,7 @@ import gym
 import numpy as np
 
 from gym import spaces
-from collections import deque
-from DeepAgent.utils.common import process_frame, LazyFrames
+from DeepAgent.utils.common import process_frame
 
 
 class FireReset(gym.Wrapper):
@@ -80,7 +79,7 @@ class NoopStart(gym.Wrapper):
         if self.override_num_noops is not None:
             noops = self.override_num_noops
         else:
-            noops = np.random.randint(1, self.noop_max + 1)
+            noops = self.unwrapped.np_random.integers(1, self.noop_max + 1)
         assert noops > 0
         obs = None
         for _ in range(noops):
@@ -99,6 +98,7 @@ class MaxAndSkip(gym.Wrapper):
         gym.Wrapper.__init__(self, env)
         # most recent raw observations (for max pooling across time steps)
         self._obs_buffer = np.zeros((2,) + env.observation_space.shape, dtype=np.uint8)
+        self._max_out = np.empty(env.observation_space.shape, dtype=np.uint8)
         self._skip = skip
 
     def step(self, action):
@@ -115,7 +115,8 @@ class MaxAndSkip(gym.Wrapper):
             total_reward += reward
             if done:
                 break
-        max_frame = np.amax(self._obs_buffer, axis=0)
+        # written in place, ProcessFrame resizes it into a new frame before the next step
+        max_frame = np.maximum(self._obs_buffer[0], self._obs_buffer[1], out=self._max_out)
         return max_frame, total_reward, done, info
 
     def reset(self, **kwargs):
@@ -123,30 +124,40 @@ class MaxAndSkip(gym.Wrapper):
 
 
 class StackFrame(gym.Wrapper):
-    """Wrapper for the environment provided by Gym"""
+    """
+    Stack the last frame_stack single channel frames along the channel axis, the frames are kept
+    in a preallocated ring buffer whose newest slot is self._head.
+    """
 
     def __init__(self, env, frame_stack=4):
         super().__init__(env)
         self.frame_stack = frame_stack
-        self.frames = deque([], maxlen=frame_stack)
         shape = self.env.observation_space.shape
+        assert shape[-1] == 1, f'StackFrame expects single channel frames, got shape {shape}'
+        self._stack = np.zeros((frame_stack,) + shape[:-1], dtype=np.uint8)
+        self._head = 0
         self.observation_space = spaces.Box(low=0, high=255, shape=(shape[:-1] + (shape[-1] * frame_stack,)),
                                             dtype=env.observation_space.dtype)
 
     def reset(self):
         ob = self.env.reset()
-        for _ in range(self.frame_stack):
-            self.frames.append(ob)
+        self._stack[:] = ob[..., 0]
         return self._get_ob()
 
     def step(self, action):
         ob, reward, done, info = self.env.step(action)
-        self.frames.append(ob)
+        self._head = (self._head + 1) % self.frame_stack
+        self._stack[self._head] = ob[..., 0]
         return self._get_ob(), reward, done, info
 
     def _get_ob(self):
-        assert len(self.frames) == self.frame_stack
-        return LazyFrames(list(self.frames))
+        """
+        Returns:
+            (H, W, frame_stack) frames from the oldest to the newest, the fancy indexing copies
+            them out of the ring buffer so that the observation is not changed by later steps.
+        """
+        idx = (self._head - np.arange(self.frame_stack - 1, -1, -1)) % self.frame_stack
+        return self._stack[idx].transpose(1, 2, 0)
 
 
 class ProcessFrame(gym.ObservationWrapper):
@@ -210,6 +221,32 @@ def mergeWrapper(env_name, frame_stack=4, output_shape=(84, 84), crop=None, trai
     return env
 
 
+def make_env(env_fn, seed, **kwargs):
+    """
+    Return a closure building env_fn(**kwargs) with its own seed, it is called inside the worker process
+    of a vectorized environment (and once in the parent to read the spaces), so only the env's own
+    random generators are seeded and the global numpy state is left alone.
+    """
+
+    def _make():
+        env = env_fn(**kwargs)
+        env.unwrapped.seed(seed)
+        return env
+
+    return _make
+
+
+def make_vector_env(env_fn, n_envs, seed=None, **kwargs):
+    """
+    Run n_envs environments built by env_fn(**kwargs) in parallel processes, observations, rewards, dones
+    and actions are batched along the first axis. Environments reset automatically when done.
+    The i-th environment is seeded with seed + i, if seed is None it is drawn once for this call.
+    """
+    if seed is None:
+        seed = int(np.random.default_rng().integers(2 ** 31 - n_envs))
+    return gym.vector.AsyncVectorEnv([make_env(env_fn, seed + i, **kwargs) for i in range(n_envs)])
+
+
 class GameEnv(gym.Wrapper):
     """Wrapper for the environment provided by Gym"""
 
@@ -228,20 +265,18 @@ class GameEnv(gym.Wrapper):
         super().__init__(env)
 
     def reset(self):
-        frame = np.array(self.env.reset())
-        return frame
+        return self.env.reset()
 
     def step(self, action):
         """Performs an action and observes the result
         Arguments:
             action: An integer describe action the agent chose
         Returns:
-            next_state: The processed new frame as a result of that action
+            next_state: The stacked frames as a result of that action
             reward: The reward for taking that action
             done: Whether the test_env has ended
             info: other information
         """
         next_state, reward, done, info = self.env.step(action)
         reward = self.reward_processor(reward, done, action)
-        next_state = np.array(next_state)
         return next_state, reward, done, info
@@ -1,5 +1,7 @@
 import tensorflow as tf
 
+from DeepAgent.utils.game import make_vector_env
+
 
 def use_gpu(use=False):
     if use:
@@ -8,6 +10,31 @@ def use_gpu(use=False):
         tf.config.experimental.set_memory_growth(physical_devices[0], True)
 
 
+def use_jit(use=False):
+    """
+    Let TF cluster graphs with XLA, the agent's gradient update is compiled by XLA as a whole.
+    Not every platform supports XLA (e.g. tensorflow-metal), so it is off by default.
+    """
+    if use:
+        tf.config.optimizer.set_jit(True)
+
+
+def gpu_data_format(use=False):
+    """
+    Build the networks in NCHW when training on GPU, the CPU convolution kernels only support NHWC.
+    """
+    return 'channels_first' if use else 'channels_last'
+
+
+def use_mixed_precision(use=False):
+    """
+    Compute conv and dense layers in float16 with float32 variables, the output layers stay in float32.
+    Must be called before the networks are built.
+    """
+    if use:
+        tf.keras.mixed_precision.set_global_policy('mixed_float16')
+
+
 def TrainWrapper(config, env, buffer, policy, agent, train_id):
     """
     The wrapper can be used to read and pass configuration to specific environment, buffer, policy, and agent.
@@ -16,6 +43,8 @@ def TrainWrapper(config, env, buffer, policy, agent, train_id):
         _agent: an OffPolicy agent that has been init, and call learn() to train the NN of this agent.
     """
     use_gpu(config.USE_GPU)
+    use_mixed_precision(config.MIXED_PRECISION)
+    use_jit(config.JIT_COMPILE)
 
     _env = env(
         env_name=config.ENV_NAME,
@@ -26,6 +55,18 @@ def TrainWrapper(config, env, buffer, policy, agent, train_id):
         reward_processor=config.REWARD_PROCESSOR
     )
 
+    _vector_env = make_vector_env(
+        env,
+        config.BUFFER_FILL_ENVS,
+        seed=config.BUFFER_FILL_SEED,
+        env_name=config.ENV_NAME,
+        output_shape=config.IMAGE_SHAPE,
+        frame_stack=config.FRAME_STACK,
+        train=True,
+        crop=config.CROP,
+        reward_processor=config.REWARD_PROCESSOR
+    ) if config.BUFFER_FILL_ENVS > 1 else None
+
     _buffer = buffer(
         size=config.BUFFER_SIZE,
         batch_size=config.BATCH_SIZE,
@@ -42,7 +83,8 @@ def TrainWrapper(config, env, buffer, policy, agent, train_id):
         lr_schedule=config.LEARNING_RATE,
         one_step_weight=config.ONE_STEP_WEIGHT,
         n_step_weight=config.N_STEP_WEIGHT,
-        l2_weight=0.0
+        l2_weight=0.0,
+        data_format=gpu_data_format(config.USE_GPU),
     )
 
     _target = policy(
@@ -57,6 +99,7 @@ def TrainWrapper(config, env, buffer, policy, agent, train_id):
         n_step_weight=config.N_STEP_WEIGHT,
         l2_weight=0.0,
         quiet=True,
+        data_format=gpu_data_format(config.USE_GPU),
     )
 
     _agent = agent(
@@ -71,6 +114,8 @@ def TrainWrapper(config, env, buffer, policy, agent, train_id):
         target_sync_freq=config.TARGET_SYNC_FREQ,
         saving_model=config.SAVING_MODEL,
         log_history=config.LOG_HISTORY,
+        vector_env=_vector_env,
+        jit_compile=config.JIT_COMPILE,
     )
     return _agent
 
@@ -96,13 +141,16 @@ def PolicyTestWrapper(config, policy, _env):
         optimizer=config.OPTIMIZER,
         lr_schedule=config.LEARNING_RATE,
         one_step_weight=1.0,
-        l2_weight=0.0
+        l2_weight=0.0,
+        data_format=gpu_data_format(config.USE_GPU),
     )
     return _policy
 
 
 def VisualizationWrapper(config, env, policy):
     use_gpu(config.USE_GPU)
+    use_mixed_precision(config.MIXED_PRECISION)
+    use_jit(config.JIT_COMPILE)
 
     _env = EnvTestWrapper(config, env)
     _policy = PolicyTestWrapper(config, policy, _env)
@@ -111,6 +159,8 @@ def VisualizationWrapper(config, env, policy):
 
 def TestWrapper(config, agent, env, policy, buffer):
     use_gpu(config.USE_GPU)
+    use_mixed_precision(config.MIXED_PRECISION)
+    use_jit(config.JIT_COMPILE)
 
     _env = EnvTestWrapper(config, env)
     _policy = PolicyTestWrapper(config, policy, _env)
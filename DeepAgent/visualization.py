@@ -89,6 +89,7 @@ class DeepAgent_Vis(pyglet.window.Window):
     def generate_heatmap(self, last_conv):
         with tf.GradientTape() as tape:
             last_conv_layer = self.policy.model.get_layer(last_conv)
+            data_format = last_conv_layer.data_format
 
             iterate = tf.keras.models.Model([self.policy.model.inputs],
                                             [self.policy.model.output, last_conv_layer.output])
@@ -96,6 +97,9 @@ class DeepAgent_Vis(pyglet.window.Window):
             model_out, last_conv_layer = iterate(self.state[np.newaxis, :, :, :])
             class_out = model_out[:, np.argmax(model_out[0])]
             grads = tape.gradient(class_out, last_conv_layer)
+            if data_format == 'channels_first':
+                grads = tf.transpose(grads, [0, 2, 3, 1])
+                last_conv_layer = tf.transpose(last_conv_layer, [0, 2, 3, 1])
             pooled_grads = tf.keras.backend.mean(grads, axis=(0, 1, 2))
 
         heatmap = tf.reduce_mean(tf.multiply(pooled_grads, last_conv_layer), axis=-1)
@@ -213,7 +217,7 @@ class DeepAgent_Vis(pyglet.window.Window):
 
     def update(self, dt):
         if self.done:
-            self.state = self.env.reset()
+            self.state = np.asarray(self.env.reset())
             self.episode_reward_sum = 0
             self.done = False
 
@@ -224,7 +228,7 @@ class DeepAgent_Vis(pyglet.window.Window):
         state, reward, done, _ = self.env.step(action)
         self.render_img = self.env.render(mode='rgb_array')
         self.q_vals = q_vals
-        self.state = state
+        self.state = np.asarray(state)
         self.done = done
         self.values.append(q_vals[action])
         self.episode_reward_sum += reward
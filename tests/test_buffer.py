@@ -0,0 +1,153 @@
+import numpy as np
+import pytest
+
+from DeepAgent.utils.buffer import ExperienceReplay, PrioritizedExperienceReplay, SumTree
+
+
+def generate_transitions(rng, n, frame_stack=4, shape=(3, 3)):
+    """
+    Yield (state, action, reward, done, new_state) like StackFrame, episodes end on done and
+    are also restarted without done, which the buffer has to detect from the frames alone.
+    """
+    count = [0]
+
+    def frame():
+        count[0] += 1
+        return np.full(shape, count[0] % 251, dtype=np.uint8) + rng.integers(0, 2, shape).astype(np.uint8)
+
+    def reset():
+        return np.stack([frame()] * frame_stack, axis=-1)
+
+    state = reset()
+    for _ in range(n):
+        new_state = np.concatenate([state[..., 1:], frame()[..., np.newaxis]], axis=-1)
+        done = bool(rng.random() < 0.05)
+        yield state, int(rng.integers(0, 6)), float(rng.random()), done, new_state
+        state = reset() if done or rng.random() < 0.1 else new_state
+
+
+def fill(buffer, rng, n):
+    """
+    Append n transitions and return them keyed by the slot they were written to.
+    """
+    stored = {}
+    for transition in generate_transitions(rng, n):
+        buffer.append(*transition)
+        stored[(buffer.index - 1) % buffer.size] = transition
+    return stored
+
+
+@pytest.mark.parametrize('size', [1, 7, 8, 13])
+def test_sum_tree_total_and_leaves(size):
+    tree = SumTree(size)
+    values = np.arange(1, size + 1, dtype=np.float32)
+    tree[np.arange(size)] = values
+    assert tree.total() == pytest.approx(values.sum())
+    np.testing.assert_array_equal(tree[np.arange(size)], values)
+
+
+def test_sum_tree_duplicate_indices():
+    tree = SumTree(5)
+    tree[[0, 1, 2, 3, 4]] = [1.0, 1.0, 1.0, 1.0, 1.0]
+    tree[[2, 2, 4]] = [3.0, 3.0, 0.0]
+    assert tree[2] == 3.0
+    assert tree.total() == pytest.approx(6.0)
+
+
+@pytest.mark.parametrize('size', [6, 8, 11])
+def test_sum_tree_proportional_sampling(size):
+    rng = np.random.default_rng(0)
+    tree = SumTree(size)
+    priorities = rng.random(size).astype(np.float32)
+    priorities[size // 2] = 0.0
+    tree[np.arange(size)] = priorities
+
+    indices = tree.find_prefixsum_idx(rng.uniform(0, tree.total(), size=200000))
+    frequencies = np.bincount(indices, minlength=size) / len(indices)
+
+    assert indices.min() >= 0 and indices.max() < size
+    assert frequencies[size // 2] == 0
+    np.testing.assert_allclose(frequencies, priorities / priorities.sum(), atol=0.01)
+
+
+@pytest.mark.parametrize('buffer_class', [ExperienceReplay, PrioritizedExperienceReplay])
+def test_stacks_match_appended_transitions(buffer_class):
+    rng = np.random.default_rng(1)
+    buffer = buffer_class(97, batch_size=16)
+    stored = fill(buffer, rng, 500)
+
+    for _ in range(50):
+        indices = buffer.get_sample_indices()
+        assert buffer.valid[indices].all()
+        states, actions, rewards, dones, new_states = buffer.get_sample_arrays(indices)
+        for i, index in enumerate(indices):
+            state, action, reward, done, new_state = stored[index]
+            np.testing.assert_array_equal(states[i], state)
+            np.testing.assert_array_equal(new_states[i], new_state)
+            assert actions[i] == action and dones[i] == done
+            assert rewards[i] == pytest.approx(reward)
+
+
+def test_n_step_stops_at_done_and_episode_boundary():
+    rng = np.random.default_rng(2)
+    n_step, gamma = 5, 0.9
+    buffer = ExperienceReplay(211, batch_size=32, n_step=n_step)
+
+    sequence, positions = [], {}
+    for transition in generate_transitions(rng, 700):
+        buffer.append(*transition)
+        sequence.append(transition)
+        positions[(buffer.index - 1) % buffer.size] = len(sequence) - 1
+
+    for _ in range(20):
+        indices = buffer.get_sample_indices()
+        n_step_rewards, n_step_dones, n_step_next = buffer.get_n_step_sample_arrays(indices, gamma=gamma)
+        for i, index in enumerate(indices):
+            position = positions[index]
+            _, _, reward, done, new_state = sequence[position]
+            total_reward = np.float32(reward)
+            for step in range(n_step):
+                current = sequence[position + step]
+                if done or (step > 0 and not np.array_equal(current[0], sequence[position + step - 1][4])):
+                    break
+                total_reward += np.float32(gamma ** step) * np.float32(current[2])
+                done, new_state = current[3], current[4]
+            assert n_step_rewards[i] == pytest.approx(total_reward)
+            assert n_step_dones[i] == done
+            np.testing.assert_array_equal(n_step_next[i], new_state)
+
+
+def test_stale_priority_update_keeps_invalid_slots_unsampled():
+    rng = np.random.default_rng(3)
+    buffer = PrioritizedExperienceReplay(50, batch_size=8)
+    transitions = generate_transitions(rng, 10 ** 6)
+    for _ in range(200):
+        buffer.append(*next(transitions))
+
+    stale = [buffer.get_sample_indices() for _ in range(4)]
+    for _ in range(100):
+        for _ in range(4):
+            buffer.append(*next(transitions))
+        indices = stale.pop(0)
+        buffer.update_priorities(indices, rng.random(len(indices)))
+        assert (buffer.tree[np.flatnonzero(~buffer.valid)] == 0).all()
+        stale.append(buffer.get_sample_indices())
+        assert buffer.valid[stale[-1]].all()
+
+
+def test_stale_priority_update_skips_rewritten_slots():
+    rng = np.random.default_rng(4)
+    buffer = PrioritizedExperienceReplay(50, batch_size=8)
+    transitions = generate_transitions(rng, 10 ** 6)
+    for _ in range(100):
+        buffer.append(*next(transitions))
+
+    indices = buffer.get_sample_indices()
+    generations = buffer.generations[indices].copy()
+    buffer.max_priority = 10.0
+    for _ in range(buffer.size):
+        buffer.append(*next(transitions))
+
+    rewritten = buffer.tree[indices].copy()
+    buffer.update_priorities(indices, np.zeros(len(indices)), generations)
+    np.testing.assert_array_equal(buffer.tree[indices], rewritten)
@@ -0,0 +1,110 @@
+import threading
+
+import numpy as np
+import pytest
+
+from DeepAgent.agents import DQNAgent, D3NPERAgent
+from DeepAgent.utils.buffer import ExperienceReplay, PrioritizedExperienceReplay
+
+FRAME_STACK = 4
+N_STEP = 3
+
+
+def encode(counter):
+    """
+    A (2, 2) frame whose pixels spell out counter, so a batch shows which frames it was gathered from.
+    """
+    return np.array([[counter % 256, counter // 256 % 256], [0, 0]], dtype=np.uint8)
+
+
+def decode(frames):
+    """
+    Counters of the (..., 2, 2, frame_stack) stacked frames, returned with shape (..., frame_stack).
+    """
+    return frames[..., 0, 0, :].astype(np.int64) + 256 * frames[..., 0, 1, :].astype(np.int64)
+
+
+def append_episode(buffer, start, stop):
+    """
+    Append one never ending episode, the transition whose new frame is counter c has reward c.
+    """
+    state = np.stack([encode(c) for c in range(start - FRAME_STACK, start)], axis=-1)
+    for counter in range(start, stop):
+        new_state = np.concatenate([state[..., 1:], encode(counter)[..., np.newaxis]], axis=-1)
+        buffer.append(state, counter % 6, float(counter), False, new_state)
+        state = new_state
+
+
+def make_agent(agent_class, buffer):
+    agent = agent_class.__new__(agent_class)
+    agent.buffer = buffer
+    agent.gamma = 0.99
+    agent.input_shape = (2, 2, FRAME_STACK)
+    agent.prefetch_batches = 2
+    return agent
+
+
+def check_batch(states, actions, rewards, new_states):
+    counters = decode(states)
+    np.testing.assert_array_equal(np.diff(counters, axis=-1), 1)
+    np.testing.assert_array_equal(decode(new_states), counters + 1)
+    np.testing.assert_array_equal(rewards, counters[:, -1] + 1)
+    np.testing.assert_array_equal(actions, (counters[:, -1] + 1) % 6)
+
+
+def run_with_writer(buffer, consume, start=FRAME_STACK, n_steps=3000):
+    """
+    Call consume() repeatedly while another thread keeps appending transitions to buffer.
+    """
+    append_episode(buffer, start, start + 200)
+    writer = threading.Thread(target=append_episode, args=(buffer, start + 200, start + 200 + n_steps))
+    writer.start()
+    try:
+        while writer.is_alive():
+            consume()
+    finally:
+        writer.join()
+
+
+def test_dqn_sample_batch_with_concurrent_appends():
+    agent = make_agent(DQNAgent, ExperienceReplay(127, batch_size=16, n_step=N_STEP))
+
+    def consume():
+        states, actions, rewards, _, new_states, _, _, n_step_next = agent.sample_batch()
+        check_batch(states, actions, rewards, new_states)
+        np.testing.assert_array_equal(decode(n_step_next), decode(new_states) + N_STEP - 1)
+
+    run_with_writer(agent.buffer, consume)
+
+
+def test_per_sample_batch_with_concurrent_appends():
+    agent = make_agent(D3NPERAgent, PrioritizedExperienceReplay(127, batch_size=16))
+    rng = np.random.default_rng(0)
+    stale = []
+
+    def consume():
+        indices, generations, states, actions, rewards, _, new_states = agent.sample_batch()
+        check_batch(states, actions, rewards, new_states)
+        stale.append((indices, generations))
+        if len(stale) > 4:
+            indices, generations = stale.pop(0)
+            agent.buffer.update_priorities(indices, rng.random(len(indices)), generations)
+
+    run_with_writer(agent.buffer, consume)
+    assert (agent.buffer.tree[np.flatnonzero(~agent.buffer.valid)] == 0).all()
+
+
+@pytest.mark.parametrize('agent_class, buffer_class', [(DQNAgent, ExperienceReplay),
+                                                       (D3NPERAgent, PrioritizedExperienceReplay)])
+def test_batch_iterator_with_concurrent_appends(agent_class, buffer_class):
+    agent = make_agent(agent_class, buffer_class(127, batch_size=16, n_step=N_STEP))
+    append_episode(agent.buffer, FRAME_STACK, FRAME_STACK + 200)
+    iterator = agent.build_batch_iterator()
+    offset = 2 if agent_class is D3NPERAgent else 0
+
+    def consume():
+        batch = [tensor.numpy() for tensor in next(iterator)]
+        states, actions, rewards, _, new_states = batch[offset:offset + 5]
+        check_batch(states, actions, rewards, new_states)
+
+    run_with_writer(agent.buffer, consume, start=FRAME_STACK + 200)